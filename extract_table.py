@@ -8,8 +8,12 @@ import re
 import os
 import sys
 import shutil
+import codecs
 import config
-from typing import Optional, List, Dict, Any
+from bisect import bisect_right
+from itertools import groupby
+from operator import itemgetter
+from typing import Optional, List, Dict, Any, Union
 from dotenv import load_dotenv
 
 try:
@@ -17,6 +21,12 @@ try:
 except ImportError:
     fitz = None
 
+try:
+    import pyarrow as pa  # Écriture CSV plus rapide (optionnel)
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
 # Définition des bornes de colonnes (estimées d'après l'analyse)
 # Date < 90
 # Libellé: 90 - 280
@@ -34,47 +44,92 @@ COLUMN_BOUNDS = {
     "credit_limit": 515
 }
 
+# Colonnes dans l'ordre des x croissants : un mot d'abscisse x tombe dans
+# COLUMN_NAMES[bisect_right(COLUMN_EDGES, x)] (même règle "x < limite" que ci-dessus)
+COLUMN_EDGES = list(COLUMN_BOUNDS.values())
+COLUMN_NAMES = ["Date", "Libellé", "Date Valeur", "Débit", "Crédit", "Solde"]
+
+# Ordre des colonnes du DataFrame extrait
+TX_COLUMNS = ["Date", "Date Valeur", "Libellé", "Débit", "Crédit", "Solde"]
+# Séparateur entre les mots d'un même champ (montants et dates : mots collés, ex: "767" "000")
+TX_SEPARATORS = {"Libellé": " "}
+
+# Traces de détection des lignes "Total" (désactivées par défaut)
+DEBUG = False
+DEBUG_LOG = "debug_total.log"
+
+# Expressions régulières compilées une seule fois (utilisées dans les boucles)
+_DATE_RE = re.compile(r"^\d{2}/\d{2}/\d{4}$")
+_NUM_RE = re.compile(r'\d+')
+_NONDIGIT_RE = re.compile(r'[^\d]')
+_AMOUNT_RE = re.compile(r'^[\d.,]+$')
+
+def natural_sort_key(filename):
+    """Clé de tri naturel : premier nombre du nom (ex: page_2 avant page_10), 0 sinon."""
+    m = _NUM_RE.search(filename)
+    return int(m.group()) if m else 0
+
+# Lignes à ignorer dès qu'elles contiennent l'un de ces motifs
+IGNORE_PATTERNS = [
+    "Libellé", "Valeur", "Débit", "Crédit", "Solde", # En-tête tableau
+    "Solde précédent", # Ligne de solde initial
+    "Edité le", "www.orabank.net", "ORABANK", "Capital de", "RCCM", # Pied de page
+    "Veuillez noter que vous disposez", "Place de l'indépendance", "Tél. :", # Mentions légales
+    "Total général", "Total des mouvements" # Totaux
+]
+# "Date" seul n'est pas filtré : l'en-tête "Date ... Libellé" l'est déjà via "Libellé".
+# "Page" n'est filtré qu'accompagné d'un "/" (ex: "Page 1/3")
+_IGNORE_RE = re.compile("|".join(re.escape(p) for p in IGNORE_PATTERNS))
+_PAGE_RE = re.compile(r"Page.*/|/.*Page")
+
+# Clé (bloc, ligne) d'un mot renvoyé par get_text("words")
+_line_key = itemgetter(5, 6)
+
 def clean_amount(text: str) -> float:
     """Nettoie une chaîne de montant et la convertit en float."""
     if not text:
         return 0.0
     # Enlever les espaces et caractères non numériques (sauf virgule/point)
     # Format '767 000' -> 767000
-    cleaned = re.sub(r'[^\d]', '', text)
+    cleaned = _NONDIGIT_RE.sub('', text)
     try:
         return float(cleaned)
     except ValueError:
         return 0.0
 
-def extract_transactions_from_pdf(pdf_path: str) -> pd.DataFrame:
+def _append_tx(tx_columns: Dict[str, List[str]], tx: Dict[str, List[str]]) -> None:
+    """Ajoute une transaction aux listes de colonnes, en joignant les mots de chaque champ."""
+    for name, values in tx_columns.items():
+        values.append(TX_SEPARATORS.get(name, "").join(tx[name]))
+
+def extract_transactions_from_pdf(pdf: Union[str, "fitz.Document"]) -> pd.DataFrame:
     """
     Extrait les transactions en utilisant les coordonnées des mots.
+    Accepte un chemin ou un document déjà ouvert (qui n'est alors pas fermé ici).
     """
     if not fitz:
         raise ImportError("Le module 'PyMuPDF' n'est pas installé. pip install PyMuPDF")
 
-    print(f"📄 Analyse précise (layout) du fichier PDF: {pdf_path}")
-    doc = fitz.open(pdf_path)
+    owns_doc = isinstance(pdf, str)
+    doc = fitz.open(pdf) if owns_doc else pdf
+    print(f"📄 Analyse précise (layout) du fichier PDF: {doc.name}")
     
-    transactions = []
+    # Stockage par colonnes (une liste par champ) : le DataFrame est construit sans transposition
+    tx_columns = {name: [] for name in TX_COLUMNS}
     
     # Variables pour suivre l'état courant
     current_tx = {}
     
+    # Traces de détection des totaux, écrites en une fois à la fin (si DEBUG)
+    debug_lines = []
+    
     for page_num, page in enumerate(doc):
+        # PyMuPDF renvoie les mots dans l'ordre bloc -> ligne -> mot :
+        # les mots d'une même ligne sont donc contigus, pas besoin de regrouper.
         words = page.get_text("words")
-        
-        rows = {} 
-        for w in words:
-            key = (w[5], w[6])
-            if key not in rows:
-                rows[key] = []
-            rows[key].append(w)
-            
-        sorted_keys = sorted(rows.keys())
-        
-        for key in sorted_keys:
-            line_words = rows[key]
+
+        for key, group in groupby(words, key=_line_key):
+            line_words = list(group)
             line_words.sort(key=lambda x: x[0])
             
             # --- TRONCATURE DES TOTAUX FUSIONNÉS ---
@@ -89,8 +144,8 @@ def extract_transactions_from_pdf(pdf_path: str) -> pd.DataFrame:
                     # Vérifier le contexte
                     snippet = "".join([wx[4] for wx in line_words[i:i+8]]).replace(" ", "").lower()
                     
-                    # with open("debug_total.log", "a", encoding="utf-8") as f:
-                    #     f.write(f"Word: {w[4]}, Snippet: {snippet}\n")
+                    if DEBUG:
+                        debug_lines.append(f"Word: {w[4]}, Snippet: {snippet}\n")
 
                     # Normalisation stricte pour détection
                     clean_snippet = snippet.replace("é", "e").replace("è", "e")
@@ -100,25 +155,25 @@ def extract_transactions_from_pdf(pdf_path: str) -> pd.DataFrame:
                         "totaldesmouvements" in clean_snippet or 
                         "totaldeb" in clean_snippet or
                         "totalcred" in clean_snippet):
-                         # with open("debug_total.log", "a", encoding="utf-8") as f:
-                         #     f.write("  -> TRUNCATED (snippet match)\n")
+                         if DEBUG:
+                             debug_lines.append("  -> TRUNCATED (snippet match)\n")
                          trunc_index = i
                          matches_total_footer = True
                          break
                     
                     # Check direct variations in the word itself or next word
                     if "totalgénéral" in w[4].replace(" ", "").lower():
-                         # with open("debug_total.log", "a", encoding="utf-8") as f:
-                         #     f.write("  -> TRUNCATED (single word)\n")
+                         if DEBUG:
+                             debug_lines.append("  -> TRUNCATED (single word)\n")
                          trunc_index = i
                          matches_total_footer = True
                          break
             
             if trunc_index != -1:
                 line_words = line_words[:trunc_index]
-                # with open("debug_total.log", "a", encoding="utf-8") as f:
-                #     remaining = [wx[4] for wx in line_words]
-                #     f.write(f"  -> REMAINING: {remaining}\n")
+                if DEBUG:
+                    remaining = [wx[4] for wx in line_words]
+                    debug_lines.append(f"  -> REMAINING: {remaining}\n")
                 
                 # Si c'était un footer "Total", on doit clôre la transaction courante
                 # car les lignes suivantes risquent d'être les montants de ce total
@@ -127,7 +182,7 @@ def extract_transactions_from_pdf(pdf_path: str) -> pd.DataFrame:
                     # On ferme tout de suite.
                     if not line_words:
                         if current_tx:
-                            transactions.append(current_tx)
+                            _append_tx(tx_columns, current_tx)
                             current_tx = {}
                         continue # On passe la ligne
                 
@@ -137,51 +192,20 @@ def extract_transactions_from_pdf(pdf_path: str) -> pd.DataFrame:
             full_line_text = " ".join([w[4] for w in line_words])
             
             # Suppression des lignes inutiles (En-têtes, Pieds de page, Mentions légales)
-            ignore_patterns = [
-                "Date", "Libellé", "Valeur", "Débit", "Crédit", "Solde", # En-tête tableau
-                "Solde précédent", # Ligne de solde initial
-                "Page", "Edité le", "www.orabank.net", "ORABANK", "Capital de", "RCCM", # Pied de page
-                "Veuillez noter que vous disposez", "Place de l'indépendance", "Tél. :", # Mentions légales
-                "Total général", "Total des mouvements" # Totaux
-            ]
-            
-            should_skip = False
-            for pattern in ignore_patterns:
-                if pattern in full_line_text:
-                    if pattern == "Date" and not ("Date" in full_line_text and "Libellé" in full_line_text):
-                        # Attention à ne pas filtrer une ligne qui contiendrait juste le mot "Date" par hasard dans le libellé ?
-                        # Mais ici on filtre l'en-tête, qui contient "Date" ET "Libellé"
-                         pass
-                    elif pattern == "Page":
-                         if "/" in full_line_text: should_skip = True
-                    else:
-                        should_skip = True
-            
-            # Raffinement pour l'en-tête exact
-            if "Date" in full_line_text and "Libellé" in full_line_text:
-                should_skip = True
-                
-            if should_skip:
+            if _IGNORE_RE.search(full_line_text) or _PAGE_RE.search(full_line_text):
                 continue
 
             first_word_x = line_words[0][0]
             first_word_text = line_words[0][4]
             
             # Check for New Transaction (Date in first column)
-            if first_word_x < COLUMN_BOUNDS["date_limit"] and re.match(r"^\d{2}/\d{2}/\d{4}$", first_word_text):
+            if first_word_x < COLUMN_BOUNDS["date_limit"] and _DATE_RE.match(first_word_text):
                 # Save previous
                 if current_tx:
-                    transactions.append(current_tx)
+                    _append_tx(tx_columns, current_tx)
                 
-                # New Tx
-                current_tx = {
-                    "Date": "",
-                    "Date Valeur": "",
-                    "Libellé": "",
-                    "Débit": "",
-                    "Crédit": "",
-                    "Solde": ""
-                }
+                # New Tx : une liste de mots par champ, jointe à la fermeture de la transaction
+                current_tx = {name: [] for name in TX_COLUMNS}
             
             # Si pas de transaction active, on ignore (ex: texte avant le tableau)
             if not current_tx:
@@ -195,42 +219,41 @@ def extract_transactions_from_pdf(pdf_path: str) -> pd.DataFrame:
                 # but we need to capture the text.
                 # However, ensure we don't capture Libelle content that overflows left (rare)
                 
-                if x < COLUMN_BOUNDS["date_limit"]:
+                col = COLUMN_NAMES[bisect_right(COLUMN_EDGES, x)]
+
+                if col == "Date":
                     # Avoid appending duplicate date if we just created it? 
                     # Actually valid date is only one word.
                     # Use = instead of += for Date to avoid "06/10/202506/10/2025" if line repeats? 
                     # Usually Date is single word.
                     if not current_tx["Date"]:
-                         current_tx["Date"] = text
+                         current_tx["Date"].append(text)
                     # Else ignore? Or could be a multiline date (unlikely)
                     
-                elif x < COLUMN_BOUNDS["libelle_limit"]:
-                    current_tx["Libellé"] += text + " "
-                elif x < COLUMN_BOUNDS["valeur_limit"]:
-                    current_tx["Date Valeur"] += text
-                elif x < COLUMN_BOUNDS["debit_limit"]:
-                    current_tx["Débit"] += text 
-                elif x < COLUMN_BOUNDS["credit_limit"]:
-                    current_tx["Crédit"] += text
-                else: # Solde
-                    current_tx["Solde"] += text
+                else:
+                    current_tx[col].append(text)
             
             # Si c'était la ligne de total (cas mixte), on ferme la transaction maintenant
             if matches_total_footer:
                 if current_tx:
-                    transactions.append(current_tx)
+                    _append_tx(tx_columns, current_tx)
                     current_tx = {}
 
     # Add last
     if current_tx:
-        transactions.append(current_tx)
+        _append_tx(tx_columns, current_tx)
         
-    doc.close()
+    if owns_doc:
+        doc.close()
+    
+    if debug_lines:
+        with open(DEBUG_LOG, "a", encoding="utf-8") as f:
+            f.writelines(debug_lines)
     
-    if not transactions:
+    if not tx_columns["Date"]:
         return pd.DataFrame()
         
-    df = pd.DataFrame(transactions)
+    df = pd.DataFrame(tx_columns, copy=False)
     
     # Cleaning
     if 'Libellé' in df.columns:
@@ -248,43 +271,37 @@ def extract_transactions_from_pdf(pdf_path: str) -> pd.DataFrame:
     
     return df
 
-def get_solde_precedent(pdf_path: str) -> float:
+def get_solde_precedent(pdf: Union[str, "fitz.Document"]) -> float:
     """Extrait le solde précédent en utilisant les coordonnées (plus sûr)."""
     if not fitz: return 0.0
     
     try:
-        doc = fitz.open(pdf_path)
+        owns_doc = isinstance(pdf, str)
+        doc = fitz.open(pdf) if owns_doc else pdf
         # On ne regarde que la première page généralement pour le solde précédent
         page = doc[0] 
         words = page.get_text("words")
-        doc.close()
+        if owns_doc:
+            doc.close()
         
-        # Trouver la ligne "Solde précédent"
-        # On cherche les mots "Solde" et "précédent" qui sont proches
-        solde_label_y = -1
+        # Une seule passe sur les mots :
+        # - on repère la ligne "Solde précédent" (mot "précédent", 1re occurrence)
+        # - on garde de côté les mots numériques à droite du label (x > 300),
+        #   qui peuvent apparaître avant ou après le label selon l'ordre des blocs
+        # Dans le debug, "Solde" (187) et "précédent" (216) sont sur la même "line" (item 94, 95).
+        solde_label_y = None
+        candidates = [] # (y0, texte)
         
         for w in words:
-            if "précédent" in w[4] and solde_label_y == -1:
-                # Vérifier si "Solde" est juste avant ou sur la même ligne
-                # Pour simplifier, on suppose que si on trouve "précédent" isolé ou "Solde précédent", c'est bon.
-                # Dans le debug, "Solde" (187) et "précédent" (216) sont sur la même "line" (item 94, 95).
+            if solde_label_y is None and "précédent" in w[4]:
                 solde_label_y = w[1] # y0 coord
-                break
+            elif w[0] > 300 and _AMOUNT_RE.match(w[4]):
+                candidates.append((w[1], w[4]))
         
-        if solde_label_y != -1:
-            # Chercher des montants sur la même ligne (avec une marge d'erreur Y)
+        if solde_label_y is not None:
+            # Montants sur la même ligne (marge d'erreur de +/- 5 pixels sur Y)
             # Le montant est normalement dans la colonne Solde (> 515)
-            montant_parts = []
-            
-            for w in words:
-                # Marge d'erreur de +/- 5 pixels sur Y
-                if abs(w[1] - solde_label_y) < 5:
-                    text = w[4]
-                    x = w[0]
-                    
-                    # On veut les chiffres qui sont à droite du label (disons > 300)
-                    if x > 300 and re.match(r'^[\d.,]+$', text):
-                         montant_parts.append(text)
+            montant_parts = [text for y, text in candidates if abs(y - solde_label_y) < 5]
             
             if montant_parts:
                 full_str = "".join(montant_parts)
@@ -293,7 +310,7 @@ def get_solde_precedent(pdf_path: str) -> float:
                     return float(full_str.replace('.', '').replace(',', ''))
                 except:
                     # Retry light clean
-                     return float(re.sub(r'[^\d]', '', full_str))
+                     return float(_NONDIGIT_RE.sub('', full_str))
                      
     except Exception as e:
         print(f"⚠️ Erreur extraction solde précédent: {e}")
@@ -304,23 +321,17 @@ def get_solde_precedent(pdf_path: str) -> float:
 def clean_and_format_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     """Nettoie et formate le DataFrame (Adapté)."""
     
-    # Nettoyage des montants
+    # Nettoyage des montants (vectorisé : on ne garde que les chiffres)
     for col in ['debit', 'credit', 'solde']:
         if col in df.columns:
-            # Fonction locale de nettoyage
-            def clean_val(x):
-                if not isinstance(x, str): return x
-                # Garder chiffres
-                c = re.sub(r'[^\d]', '', x)
-                if not c: return 0.0
-                return float(c)
-            
-            df[col] = df[col].apply(clean_val)
+            s = df[col].astype('string').str.replace(r'[^\d]', '', regex=True)
+            # to_numeric sur des 'string' renvoie Int64 ou Float64 selon les données : float64 imposé
+            df[col] = pd.to_numeric(s, errors='coerce').fillna(0.0).astype('float64')
     
-    # Dates
+    # Dates (gardées en datetime64 : le formatage à l'export se fait directement via .dt)
     for col in ['date', 'date_valeur']:
         if col in df.columns:
-            df[col] = pd.to_datetime(df[col], format='%d/%m/%Y', errors='coerce').dt.date
+            df[col] = pd.to_datetime(df[col], format='%d/%m/%Y', errors='coerce')
 
     # Filtrer les lignes vides (si date invalide)
     if 'date' in df.columns:
@@ -329,6 +340,45 @@ def clean_and_format_dataframe(df: pd.DataFrame) -> pd.DataFrame:
         
     return df
 
+def _integral_to_int(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convertit en Int64 les colonnes réelles dont toutes les valeurs sont entières (montants FCFA) :
+    écrites "2500" par df.to_csv comme par pyarrow, au lieu de "2500.0" / "2500".
+    """
+    int_cols = {}
+    for col in df.columns:
+        if pd.api.types.is_float_dtype(df[col].dtype):
+            values = df[col].dropna()
+            if (values == values.round()).all():
+                int_cols[col] = df[col].astype('Int64')
+    return df.assign(**int_cols) if int_cols else df
+
+def export_csv(df: pd.DataFrame, csv_file: str) -> None:
+    """
+    Écrit le DataFrame en CSV : point-virgule pour Excel FR, UTF-8 avec BOM.
+    Les montants entiers sont écrits sans ".0" (2500), quel que soit le writer.
+    Utilise le writer C++ de pyarrow s'il est installé, sinon df.to_csv ; la sortie est
+    identique. df.to_csv est aussi utilisé quand pyarrow écrirait autrement :
+    colonne réelle non entière (pyarrow écrit 1.2e+10 et non 12000000000.5),
+    valeur à mettre entre guillemets (';', guillemet, saut de ligne) ou colonne de types mélangés.
+    """
+    df = _integral_to_int(df)
+    
+    if pa and not any(pd.api.types.is_float_dtype(dtype) for dtype in df.dtypes):
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            with open(csv_file, "wb") as f:
+                f.write(codecs.BOM_UTF8) # BOM pour qu'Excel détecte l'UTF-8
+                # En-tête écrit à part : pyarrow le met toujours entre guillemets
+                f.write((";".join(map(str, df.columns)) + "\n").encode("utf-8"))
+                pacsv.write_csv(table, f, write_options=pacsv.WriteOptions(
+                    include_header=False, delimiter=';', quoting_style='none'))
+            return
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+
+    df.to_csv(csv_file, index=False, encoding='utf-8-sig', sep=';')
+
 def analyze_and_export(df: pd.DataFrame, output_prefix: str = "transactions", solde_precedent: float = 0.0):
     print("\n" + "="*70); print("📊 ANALYSE DES TRANSACTIONS"); print("="*70)
     
@@ -351,19 +401,20 @@ def analyze_and_export(df: pd.DataFrame, output_prefix: str = "transactions", so
         df_solde = pd.DataFrame([row_solde])
         df_final = pd.concat([df_solde, df], ignore_index=True)
     else:
-        df_final = df.copy()
+        df_final = df
 
     if df.empty: print("❌ Aucune transaction à analyser"); return
     
     print(f"📈 Nombre de transactions: {len(df)}")
-    if 'debit' in df.columns: print(f"💸 Total des débits: {df['debit'].sum():,.0f} FCFA")
-    
-    df_export = df_final.copy() # Travailler sur le DF avec solde
+    # debit est déjà numérique et sans NaN (fillna dans clean_and_format_dataframe) : somme numpy directe
+    if 'debit' in df.columns: print(f"💸 Total des débits: {df['debit'].to_numpy().sum():,.0f} FCFA")
     
     # Format dates for Excel
-    for col in ['date', 'date_valeur']:
-        if col in df_export.columns: 
-            df_export[col] = pd.to_datetime(df_export[col]).dt.strftime('%d/%m/%Y')
+    # assign() renvoie un nouveau DataFrame : df_final (et donc df) n'est pas modifié, sans copie explicite
+    df_export = df_final.assign(**{
+        col: df_final[col].dt.strftime('%d/%m/%Y')
+        for col in ['date', 'date_valeur'] if col in df_final.columns
+    })
             
     # Création du dossier de sortie s'il n'existe pas
     # Création du dossier de sortie s'il n'existe pas
@@ -371,7 +422,7 @@ def analyze_and_export(df: pd.DataFrame, output_prefix: str = "transactions", so
     os.makedirs(output_dir, exist_ok=True)
 
     csv_file = os.path.join(output_dir, f"{output_prefix}.csv")
-    df_export.to_csv(csv_file, index=False, encoding='utf-8-sig', sep=';') # Point-virgule pour Excel FR
+    export_csv(df_export, csv_file)
     print(f"\n✅ Exporté vers: {csv_file}")
     
     # try:
@@ -416,7 +467,7 @@ def batch_process_pdf_folder(source_dir=config.input_dir):
     files = [f for f in os.listdir(source_dir) if f.strip().lower().endswith(".pdf")]
     
     # Tri naturel pour traiter page_1, page_2... dans l'ordre
-    files.sort(key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0)
+    files.sort(key=natural_sort_key)
     
     print(f"\n🚀 Démarrage du traitement par lot dans: {source_dir}")
     print(f"📂 {len(files)} fichiers trouvés.\n")
@@ -426,11 +477,16 @@ def batch_process_pdf_folder(source_dir=config.input_dir):
         print(f"👉 Traitement de {filename}...")
         
         try:
-            # 1. Solde
-            solde_prec = get_solde_precedent(pdf_path)
-            
-            # 2. Extraction
-            df = extract_transactions_from_pdf(pdf_path)
+            # Le PDF est ouvert une seule fois pour le solde et l'extraction
+            doc = fitz.open(pdf_path)
+            try:
+                # 1. Solde
+                solde_prec = get_solde_precedent(doc)
+                
+                # 2. Extraction
+                df = extract_transactions_from_pdf(doc)
+            finally:
+                doc.close()
             
             # 3. Export
             if not df.empty:
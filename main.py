@@ -1,9 +1,37 @@
 import os
+import fitz  # PyMuPDF
 import pandas as pd
-import re
 import config   
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+try:
+    import pyarrow as pa  # Lecture CSV plus rapide (optionnel)
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
 
+try:
+    import xlsxwriter  # Export Excel en flux (optionnel, sinon openpyxl)
+except ImportError:
+    xlsxwriter = None
+
+from extract_table import export_csv, extract_transactions_from_pdf, clean_and_format_dataframe, analyze_and_export, get_solde_precedent, natural_sort_key
+
+
+def _write_excel_rows(df, output_xlsx):
+    """
+    Écrit le DataFrame en Excel avec xlsxwriter en mode constant_memory : chaque ligne est
+    écrite sur disque au fil de l'eau, le classeur n'est pas construit en mémoire.
+    Ce mode n'accepte que des écritures ligne par ligne (df.to_excel écrit colonne par colonne
+    et perdrait des cellules) : les lignes sont donc écrites ici avec write_row.
+    """
+    with pd.ExcelWriter(output_xlsx, engine='xlsxwriter',
+                        engine_kwargs={'options': {'constant_memory': True}}) as writer:
+        worksheet = writer.book.add_worksheet('Sheet1')
+        worksheet.write_row(0, 0, df.columns, writer.book.add_format({'bold': True}))
+        for r, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            # Cellules vides (NaN / NA) laissées vides
+            worksheet.write_row(r, 0, [None if pd.isna(v) else v for v in row])
 
 #-------------------------------------------------------------------------------------------------
 # Fonction pour parcourir le dossier de sauvegarde et recréér le dataframe complet
@@ -17,43 +45,66 @@ def process_all_pdf_files(output_dir=config.output_dir, final_output_name=config
         print(f"❌ Le dossier {output_dir} n'existe pas.")
         return pd.DataFrame()
 
-    # Lister tous les fichiers CSV
-    files = [f for f in os.listdir(output_dir) if f.endswith(".csv")]
-    
-    # Exclure le fichier de sortie s'il est déjà présent
-    files = [f for f in files if final_output_name not in f]
+    # Lister tous les fichiers CSV, en excluant le fichier de sortie s'il est déjà présent
+    # (scandir : DirEntry porte déjà le type et le chemin complet)
+    with os.scandir(output_dir) as it:
+        files = [e for e in it if e.is_file() and e.name.endswith(".csv") and final_output_name not in e.name]
 
     # Tri naturel (ex: page_2 avant page_10)
-    # On extrait le premier nombre trouvé dans le nom du fichier
-    def get_sort_key(filename):
-        numbers = re.findall(r'\d+', filename)
-        if numbers:
-            return int(numbers[0])
-        return 0
-    
-    files.sort(key=get_sort_key)
+    files.sort(key=lambda e: natural_sort_key(e.name))
     
     print(f"\n🔄 Fusion de {len(files)} fichiers CSV trouvés dans '{output_dir}'...")
     
-    all_dfs = []
-    for filename in files:
-        filepath = os.path.join(output_dir, filename)
+    # Avec pyarrow : lecture en tables Arrow (C++ multi-thread) puis une seule concaténation
+    # sans copie et une seule conversion en DataFrame. Sinon, lecture pandas classique.
+    if pa:
+        parse_options = pacsv.ParseOptions(delimiter=';')
+        # Cellules vides lues comme null, que la colonne soit vide sur toute la page ou non.
+        # Colonnes texte imposées : un libellé purement numérique (ex: 0012345) reste du texte,
+        # avec ses zéros en tête, et le type est le même sur toutes les pages
+        convert_options = pacsv.ConvertOptions(
+            strings_can_be_null=True,
+            column_types={'date': pa.string(), 'date_valeur': pa.string(), 'libelle': pa.string()}
+        )
+    
+    all_tables = []
+    for entry in files:
+        filename, filepath = entry.name, entry.path
         try:
             # Lecture avec le séparateur point-virgule utilisé à l'export
-            df = pd.read_csv(filepath, sep=';')
+            if pa:
+                table = pacsv.read_csv(filepath, parse_options=parse_options,
+                                       convert_options=convert_options)
+            else:
+                table = pd.read_csv(filepath, sep=';')
             # Ajout d'une colonne source pour traçabilité (optionnel)
             # df['source_file'] = filename
-            all_dfs.append(df)
-            print(f"  - Chargé: {filename} ({len(df)} lignes)")
+            all_tables.append(table)
+            print(f"  - Chargé: {filename} ({len(table)} lignes)")
         except Exception as e:
             print(f"  ⚠️ Erreur lors de la lecture de {filename}: {e}")
 
-    if not all_dfs:
+    if not all_tables:
         print("❌ Aucun fichier valide n'a été chargé.")
         return pd.DataFrame()
 
     # Concaténation
-    full_df = pd.concat(all_dfs, ignore_index=True)
+    if pa:
+        # promote_options="permissive" : une colonne vide sur une page (type null) ou lue
+        # en int64 sur une page et en double sur une autre est unifiée
+        try:
+            full_table = pa.concat_tables(all_tables, promote_options="permissive")
+            full_df = full_table.to_pandas(types_mapper=pd.ArrowDtype)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Types inconciliables (ex: texte contre nombre) : concaténation pandas
+            full_df = pd.concat([t.to_pandas() for t in all_tables], ignore_index=True)
+    else:
+        full_df = pd.concat(all_tables, ignore_index=True)
+    
+    # Les libellés d'opérations se répètent beaucoup : stockage en catégories
+    # (une table de chaînes + des codes entiers) plutôt qu'une chaîne par ligne
+    if 'libelle' in full_df.columns:
+        full_df['libelle'] = full_df['libelle'].astype('category')
     
     # Export du résultat global
     output_csv = os.path.join(output_dir, f"{final_output_name}.csv")
@@ -61,66 +112,91 @@ def process_all_pdf_files(output_dir=config.output_dir, final_output_name=config
     
     print(f"\n💾 Sauvegarde du fichier global ({len(full_df)} lignes)...")
     
-    full_df.to_csv(output_csv, index=False, sep=';', encoding='utf-8-sig')
+    export_csv(full_df, output_csv)
     print(f"  ✅ CSV: {output_csv}")
     
     try:
-        full_df.to_excel(output_xlsx, index=False)
+        if xlsxwriter:
+            _write_excel_rows(full_df, output_xlsx)
+        else:
+            full_df.to_excel(output_xlsx, index=False)
         print(f"  ✅ Excel: {output_xlsx}")
     except ImportError:
-        print("  ⚠️ Module openpyxl manquant pour l'export Excel.")
+        print("  ⚠️ Module xlsxwriter ou openpyxl manquant pour l'export Excel (pip install xlsxwriter).")
     except Exception as e:
         print(f"  ⚠️ Erreur export Excel: {e}")
         
     return full_df
 
-from extract_table import extract_transactions_from_pdf, clean_and_format_dataframe, analyze_and_export, get_solde_precedent
+def _process_one(pdf_path):
+    """
+    Extrait et exporte les transactions d'un seul PDF.
+    Fonction de niveau module pour pouvoir être exécutée dans un processus fils.
+    Renvoie True si des transactions ont été exportées.
+    """
+    filename = os.path.basename(pdf_path)
+    pdf_name = os.path.splitext(filename)[0]
+    
+    print(f"\n📄 Traitement de: {filename}")
+    
+    try:
+        # Le PDF est ouvert une seule fois pour le solde et l'extraction
+        doc = fitz.open(pdf_path)
+        try:
+            # 1. Tentative récupération solde (si présent sur la page)
+            # Note: Souvent présent uniquement sur la première page ou en bas de page
+            solde_prec = get_solde_precedent(doc)
+            
+            # 2. Extraction
+            df = extract_transactions_from_pdf(doc)
+        finally:
+            doc.close()
+        
+        # 3. Nettoyage et Export
+        if not df.empty:
+            df_clean = clean_and_format_dataframe(df)
+            # On exporte chaque page individuellement (pour debug et sécu)
+            # Le nom du fichier PDF sert de préfixe
+            analyze_and_export(df_clean, pdf_name, solde_prec)
+            return True
+        
+        print(f"  ⚠️ Aucune transaction trouvée sur {filename}")
+            
+    except Exception as e:
+        print(f"  ❌ Erreur sur {filename}: {e}")
+    
+    return False
 
 def run_full_extraction(source_dir=config.input_dir, output_dir=config.output_dir):
     """
     Parcourt tous les PDF du dossier source, extrait les transactions
     et génère les fichiers CSV individuels.
+    Les fichiers sont indépendants : ils sont traités en parallèle (un processus par cœur).
     """
     if not os.path.exists(source_dir):
         print(f"❌ Dossier source introuvable: {source_dir}")
         return
 
     # Lister les fichiers PDF
-    pdf_files = [f for f in os.listdir(source_dir) if f.lower().endswith(".pdf")]
+    with os.scandir(source_dir) as it:
+        pdf_files = [e for e in it if e.is_file() and e.name.lower().endswith(".pdf")]
     
     # Tri naturel (page_1, page_2, ..., page_10)
-    pdf_files.sort(key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0)
+    pdf_files.sort(key=lambda e: natural_sort_key(e.name))
     
     print(f"\n🚀 Démarrage de l'extraction sur {len(pdf_files)} fichiers...")
     
     success_count = 0
     
-    for filename in pdf_files:
-        pdf_path = os.path.join(source_dir, filename)
-        pdf_name = os.path.splitext(filename)[0]
-        
-        print(f"\n📄 Traitement de: {filename}")
-        
-        try:
-            # 1. Tentative récupération solde (si présent sur la page)
-            # Note: Souvent présent uniquement sur la première page ou en bas de page
-            solde_prec = get_solde_precedent(pdf_path)
-            
-            # 2. Extraction
-            df = extract_transactions_from_pdf(pdf_path)
-            
-            # 3. Nettoyage et Export
-            if not df.empty:
-                df_clean = clean_and_format_dataframe(df)
-                # On exporte chaque page individuellement (pour debug et sécu)
-                # Le nom du fichier PDF sert de préfixe
-                analyze_and_export(df_clean, pdf_name, solde_prec)
-                success_count += 1
-            else:
-                print(f"  ⚠️ Aucune transaction trouvée sur {filename}")
-                
-        except Exception as e:
-            print(f"  ❌ Erreur sur {filename}: {e}")
+    # Chaque processus ouvre son propre document (fitz.Document n'est pas picklable)
+    with ProcessPoolExecutor() as executor:
+        futures = {executor.submit(_process_one, e.path): e.name for e in pdf_files}
+        for future in as_completed(futures):
+            try:
+                if future.result():
+                    success_count += 1
+            except Exception as e:
+                print(f"  ❌ Erreur sur {futures[future]}: {e}")
 
     print(f"\n✨ Extraction terminée. {success_count}/{len(pdf_files)} fichiers traités avec succès.")
 
@@ -1,90 +1,319 @@
 import fitz # PyMuPDF
 import subprocess
-import pytesseract
-from PIL import Image
-import io
 import os
 import shutil 
 import config 
+import asyncio
+import math
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # 🚨 CHEMINS TESSERACT : UTILISEZ CEUX QUE VOUS AVEZ VÉRIFIÉS 🚨
 TESSERACT_PATH = r"C:\Users\HP ELITE BOOK\AppData\Local\Programs\Tesseract-OCR\tesseract.exe" 
 TESSDATA_DIR = r"C:\Users\HP ELITE BOOK\AppData\Local\Programs\Tesseract-OCR\tessdata"
 
-# Configuration de l'environnement Python pour Tesseract
-pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+TESSERACT_LANG = "fra" 
+
+# Configuration de l'environnement pour Tesseract
 # Définit la variable d'environnement TESSDATA_PREFIX (plus fiable)
 os.environ['TESSDATA_PREFIX'] = TESSDATA_DIR 
 
-def generate_ocr_split(input_pdf_path, output_split_dir=config.input_dir):
+# Threads OpenMP par processus Tesseract (OMP_THREAD_LIMIT). Par défaut 1 : le parallélisme
+# se fait entre les pages, sans que N Tesseract x 4 threads se disputent les cœurs.
+# Sur une machine à beaucoup de cœurs, OCR_INNER_THREADS=4 donne cpu_count // 4 Tesseract
+# en parallèle avec 4 threads chacun.
+OCR_INNER_THREADS = int(os.environ.get("OCR_INNER_THREADS", 1))
+# Environnement des sous-processus Tesseract : hérite de l'environnement courant (TESSDATA_PREFIX)
+TESSERACT_ENV = {**os.environ, 'OMP_THREAD_LIMIT': str(OCR_INNER_THREADS)}
+
+# Dossier des images temporaires : /dev/shm (en mémoire) sous Linux s'il existe et a assez
+# de place libre, sinon le dossier temporaire du système (%TEMP% sous Windows)
+SHM_DIR = "/dev/shm"
+
+# Résolution de rendu des pages avant OCR
+OCR_DPI = 220
+
+# Résolution du second essai pour les pages dont l'OCR a échoué (None : pas de second essai)
+OCR_RETRY_DPI = 400
+
+# Nombre maximal de pages OCR traitées simultanément
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", max(1, os.cpu_count() // OCR_INNER_THREADS)))
+
+# Pages ayant déjà une couche texte de plus de TEXT_LAYER_MIN_CHARS caractères :
+# copiées telles quelles, sans rendu ni OCR
+TEXT_LAYER_MIN_CHARS = 50
+
+# Nombre maximal de pages par appel Tesseract (démarrage et chargement du modèle amortis)
+OCR_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", 8))
+
+def _render_page(doc, i, dpi, colorspace):
+    """Rend la page i du document en image (Pixmap) pour l'OCR."""
+    return doc.load_page(i).get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+
+async def _run_tesseract(image, dpi, input_bytes=None):
     """
-    Traite le PDF page par page, effectue l'OCR et sauvegarde chaque page 
-    individuellement dans un dossier.
+    Lance Tesseract sur `image` (image, fichier liste d'images, ou "-" pour lire stdin)
+    et renvoie le PDF produit sur stdout ("-"). Lève CalledProcessError en cas d'échec.
+    dpi : résolution de rendu des images. Le format PNM ne la transporte pas : sans --dpi,
+    Tesseract l'estime et les pages du PDF produit n'ont plus la taille (en points) de
+    l'original, dont dépendent les bornes de colonnes de l'extraction.
     """
+    command = [
+        TESSERACT_PATH,
+        image, 
+        '-',
+        '--dpi', str(dpi),
+        '-l', TESSERACT_LANG,
+        'pdf' 
+    ]
     
-    TESSERACT_LANG = "fra" 
+    # stdout : PDF binaire, jamais décodé ; stderr décodé seulement en cas d'échec.
+    # Sans image sur stdin (fichier liste), pas de tube d'entrée à créer.
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE if input_bytes is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=TESSERACT_ENV
+    )
+    pdf_bytes, stderr = await process.communicate(input=input_bytes)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, command, pdf_bytes, stderr.decode("utf-8", "replace")
+        )
+    return pdf_bytes
+
+def _remove_files(paths):
+    """Supprime les fichiers temporaires encore présents."""
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _temp_root(needed_bytes):
+    """
+    Renvoie SHM_DIR s'il existe et a au moins `needed_bytes` libres, sinon None
+    (dossier temporaire par défaut). Un /dev/shm trop petit (64 Mo par défaut sous Docker)
+    ferait échouer l'écriture des images en cours de traitement.
+    """
+    if not os.path.isdir(SHM_DIR):
+        return None
+    st = os.statvfs(SHM_DIR)
+    return SHM_DIR if st.f_bavail * st.f_frsize >= needed_bytes else None
+
+def _max_page_pixels(doc, pages, dpi):
+    """Nombre de pixels de la plus grande des pages une fois rendue à `dpi`."""
+    scale = (dpi / 72) ** 2
+    return max((doc[i].rect.width * doc[i].rect.height * scale for i in pages), default=0)
+
+def _prepare_batch(doc, pages, dpi, colorspace, temp_dir):
+    """
+    Rend les pages d'un lot pour Tesseract (exécuté dans le thread de rendu).
+    Les images d'un lot de plusieurs pages sont écrites dans temp_dir.
+    Renvoie (image, input_bytes, temp_files) : les arguments de _run_tesseract
+    et les fichiers temporaires à supprimer une fois l'OCR terminé.
+    """
+    if len(pages) == 1:
+        # Page seule : image PNM brute envoyée sur stdin, aucun fichier temporaire
+        # (PNM = en-tête + pixels, sans compression PNG à l'encodage ni décodage dans Tesseract)
+        return '-', _render_page(doc, pages[0], dpi, colorspace).tobytes("pnm"), []
     
+    # Plusieurs pages : Tesseract lit un fichier liste (une image par ligne)
+    # et produit un seul PDF, redécoupé ensuite page par page
+    image_files = [os.path.join(temp_dir, f"p{i+1}.pnm") for i in pages]
+    list_file = os.path.join(temp_dir, f"batch_{pages[0]+1}.txt")
+    temp_files = image_files + [list_file]
     try:
-        # Nettoyage et création du dossier de sortie
-        if os.path.exists(output_split_dir):
-            print(f"Nettoyage du dossier existant : '{output_split_dir}'")
-            for filename in os.listdir(output_split_dir):
-                file_path = os.path.join(output_split_dir, filename)
-                try:
-                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    print(f"Erreur lors de la suppression de {file_path}: {e}")
+        for i, image_file in zip(pages, image_files):
+            _render_page(doc, i, dpi, colorspace).save(image_file)
+        with open(list_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(image_files) + "\n")
+    except BaseException:
+        _remove_files(temp_files)
+        raise
+    return list_file, None, temp_files
+
+def _save_pages(pdf_bytes, pages, split_tpl):
+    """
+    Enregistre le PDF OCR d'un lot, une page par fichier (exécuté dans le thread de rendu).
+    split_tpl : modèle du chemin de sortie, formaté avec le numéro de page.
+    """
+    if len(pages) == 1:
+        with open(split_tpl.format(pages[0]+1), "wb") as f:
+            f.write(pdf_bytes)
+        return
+    
+    # Les pages du PDF combiné sont dans l'ordre de la liste
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as combined:
+        for j, i in enumerate(pages):
+            with fitz.open() as single:
+                single.insert_pdf(combined, from_page=j, to_page=j)
+                single.save(split_tpl.format(i+1))
+
+def _copy_text_pages(doc, split_tpl):
+    """
+    Copie directement les pages qui ont déjà une couche texte (PDF natif)
+    et renvoie la liste des pages restant à passer à l'OCR.
+    """
+    ocr_pages = []
+    for i in range(doc.page_count):
+        if len(doc[i].get_text("text").strip()) > TEXT_LAYER_MIN_CHARS:
+            with fitz.open() as single:
+                single.insert_pdf(doc, from_page=i, to_page=i)
+                single.save(split_tpl.format(i+1))
         else:
-            os.makedirs(output_split_dir)
-            print(f"Création du dossier de sortie : '{output_split_dir}'")
+            ocr_pages.append(i)
+    return ocr_pages
+
+async def _render_producer(doc, batches, queue, render_executor, n_workers, dpi, colorspace, temp_dir):
+    """
+    Rend les lots les uns après les autres et les place dans la file.
+    La file est bornée : le rendu ne prend pas plus de quelques lots d'avance sur l'OCR.
+    """
+    loop = asyncio.get_running_loop()
+    for pages in batches:
+        image, input_bytes, temp_files = await loop.run_in_executor(
+            render_executor, _prepare_batch, doc, pages, dpi, colorspace, temp_dir
+        )
+        await queue.put((pages, image, input_bytes, temp_files))
+    
+    # Un marqueur de fin par consommateur
+    for _ in range(n_workers):
+        await queue.put(None)
+
+async def _ocr_worker(queue, render_executor, split_tpl, failed, dpi):
+    """
+    Consomme les lots rendus : un Tesseract à la fois par consommateur.
+    Un échec de Tesseract n'interrompt pas le traitement : les pages du lot
+    sont ajoutées à `failed`.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        
+        pages, image, input_bytes, temp_files = item
+        try:
+            pdf_bytes = await _run_tesseract(image, dpi, input_bytes)
+        except subprocess.CalledProcessError as e:
+            print(f"⚠️ Pages {', '.join(str(i+1) for i in pages)} : Tesseract a échoué avec le code {e.returncode}. Sortie : {e.stderr}")
+            failed.extend(pages)
+            continue
+        finally:
+            # Nettoyage
+            _remove_files(temp_files)
+        
+        await loop.run_in_executor(render_executor, _save_pages, pdf_bytes, pages, split_tpl)
+        
+        # print(f"Pages {', '.join(str(i+1) for i in pages)} : OCR terminé")
+
+async def _run_pipeline(doc, batches, split_tpl, render_executor, dpi, colorspace, temp_dir):
+    """
+    Enchaîne rendu et OCR des lots en pipeline : le rendu (MuPDF) d'un lot se fait
+    pendant l'OCR (Tesseract) des lots précédents, avec au plus OCR_CONCURRENCY
+    Tesseract à la fois. Renvoie la liste triée des pages en échec.
+    """
+    failed = []
+    n_workers = min(OCR_CONCURRENCY, len(batches))
+    queue = asyncio.Queue(maxsize=OCR_CONCURRENCY)
+    await asyncio.gather(
+        _render_producer(doc, batches, queue, render_executor, n_workers, dpi, colorspace, temp_dir),
+        *(_ocr_worker(queue, render_executor, split_tpl, failed, dpi) for _ in range(n_workers))
+    )
+    return sorted(failed)
+
+def _all_failed(failed, batches):
+    """Vrai si plusieurs lots ont été traités et qu'ils ont tous échoué."""
+    return len(batches) > 1 and len(failed) == sum(len(pages) for pages in batches)
+
+async def _ocr_all(doc, output_split_dir, dpi, colorspace, retry_dpi):
+    """
+    Découpe le document en lots et les passe à l'OCR. Les pages d'un lot en échec sont
+    refaites page par page à la même résolution, puis celles qui échouent encore à retry_dpi.
+    Si tous les lots d'un passage échouent (ex: langue Tesseract absente), l'erreur ne vient
+    pas des pages : pas de nouvel essai.
+    Renvoie la liste des pages (numérotées à partir de 0) toujours en échec.
+    """
+    # Chemin de sortie construit une seule fois ; numéros complétés par des zéros
+    # (ocr_page_007.pdf) pour que l'ordre alphabétique suive l'ordre des pages
+    width = len(str(doc.page_count))
+    split_tpl = os.path.join(output_split_dir, f"ocr_page_{{:0{width}d}}.pdf")
+    
+    # Un seul thread pour tous les appels PyMuPDF : le document n'est pas partagé entre threads
+    # et la boucle asyncio reste libre pour alimenter les Tesseract en cours.
+    # Les images temporaires vont dans un dossier dédié, supprimé en fin de traitement
+    # même si des lots ont été interrompus.
+    with ThreadPoolExecutor(max_workers=1) as render_executor:
+        loop = asyncio.get_running_loop()
+        ocr_pages = await loop.run_in_executor(render_executor, _copy_text_pages, doc, split_tpl)
+        if len(ocr_pages) < doc.page_count:
+            print(f"{doc.page_count - len(ocr_pages)} pages déjà textuelles copiées sans OCR")
+        
+        # Lots plus petits sur un document court, pour occuper tous les Tesseract en parallèle
+        batch_size = max(1, min(OCR_BATCH_SIZE, math.ceil(len(ocr_pages) / OCR_CONCURRENCY)))
+        batches = [ocr_pages[start:start + batch_size] for start in range(0, len(ocr_pages), batch_size)]
+        
+        # Place occupée au pire par les images temporaires : un lot par Tesseract en cours,
+        # autant en file d'attente et un en cours de rendu (les pages seules passent par stdin)
+        page_bytes = await loop.run_in_executor(render_executor, _max_page_pixels, doc, ocr_pages, dpi)
+        needed_bytes = (2 * OCR_CONCURRENCY + 1) * batch_size * page_bytes * colorspace.n if batch_size > 1 else 0
+        
+        with tempfile.TemporaryDirectory(prefix="ocr_", dir=_temp_root(needed_bytes)) as temp_dir:
+            failed = await _run_pipeline(doc, batches, split_tpl, render_executor, dpi, colorspace, temp_dir)
+            
+            # Lots en échec refaits page par page à la même résolution : une page défaillante
+            # ne fait pas repasser les autres pages de son lot à une autre résolution
+            if failed and batch_size > 1 and not _all_failed(failed, batches):
+                batches = [[i] for i in failed]
+                print(f"Nouvel essai de {len(failed)} pages, une par une...")
+                failed = await _run_pipeline(doc, batches, split_tpl, render_executor, dpi, colorspace, temp_dir)
+            
+            # Dernier essai à plus haute résolution pour les pages encore en échec
+            if failed and retry_dpi and not _all_failed(failed, batches):
+                print(f"Nouvel essai de {len(failed)} pages à {retry_dpi} DPI...")
+                failed = await _run_pipeline(doc, [[i] for i in failed], split_tpl,
+                                             render_executor, retry_dpi, colorspace, temp_dir)
+    return failed
+
+def generate_ocr_split(input_pdf_path, output_split_dir=config.input_dir,
+                       dpi=OCR_DPI, colorspace=fitz.csGRAY, retry_dpi=OCR_RETRY_DPI):
+    """
+    Traite le PDF page par page, effectue l'OCR et sauvegarde chaque page 
+    individuellement dans un dossier.
+    Les pages sont indépendantes : plusieurs Tesseract tournent en parallèle (OCR_CONCURRENCY).
+    dpi / colorspace : rendu des pages avant OCR (niveaux de gris à 220 DPI par défaut,
+    suffisant pour du texte et ~6x moins de données qu'un RGB à 300 DPI).
+    Une page dont l'OCR échoue n'interrompt pas le traitement : elle est refaite seule,
+    puis à retry_dpi, et signalée si elle échoue encore.
+    Renvoie None si aucune page n'a pu être produite.
+    """
+    
+    try:
+        # Nettoyage et création du dossier de sortie (suppression récursive en une fois)
+        print(f"Préparation du dossier de sortie : '{output_split_dir}'")
+        shutil.rmtree(output_split_dir, ignore_errors=True)
+        os.makedirs(output_split_dir, exist_ok=True)
             
         doc = fitz.open(input_pdf_path)
         print(f"Démarrage de l'OCR sur {doc.page_count} pages...")
         
         # Nous n'avons plus besoin de temp_ocr_files car il n'y a pas de fusion
         
-        for i in range(doc.page_count):
-            page = doc.load_page(i)
-            
-            # 1. Conversion de la page en image PNG (haute résolution)
-            pix = page.get_pixmap(dpi=300) 
-            temp_image_file = f"temp_ocr_page_{i+1}.png"
-            pix.save(temp_image_file)
-            
-            # 2. Définition des chemins de sortie
-            temp_pdf_file = f"temp_ocr_page_{i+1}.pdf"
-            split_output_file = os.path.join(output_split_dir, f"ocr_page_{i+1}.pdf")
-            
-            # 3. Exécution de Tesseract (génère temp_pdf_file)
-            command = [
-                TESSERACT_PATH,
-                temp_image_file, 
-                temp_pdf_file[:-4], # Fichier de sortie temporaire (nom sans extension .pdf)
-                '-l', TESSERACT_LANG,
-                'pdf' 
-            ]
-            
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            
-            # 4. Déplacement du fichier OCR final vers le dossier de split
-            shutil.move(temp_pdf_file, split_output_file)
-            
-            # 5. Nettoyage
-            os.remove(temp_image_file)
-            
-            # print(f"Page {i+1} : OCR terminé et enregistré dans '{split_output_file}'")
-
-        doc.close()
+        page_count = doc.page_count
+        try:
+            failed = asyncio.run(_ocr_all(doc, output_split_dir, dpi, colorspace, retry_dpi))
+        finally:
+            doc.close()
+        
+        if failed and len(failed) == page_count:
+            print(f"\nERREUR: OCR impossible pour toutes les pages ({page_count}), aucune page produite.")
+            return None
+        if failed:
+            print(f"\n⚠️ OCR impossible pour {len(failed)} pages : {', '.join(str(i+1) for i in failed)}")
         
         # print("\n✅ Succès : Toutes les pages OCR ont été enregistrées individuellement.")
         return output_split_dir
 
-    except subprocess.CalledProcessError as e:
-        print(f"\nERREUR TESSERACT: Tesseract a échoué avec le code {e.returncode}. Sortie : {e.stderr}")
-        return None
     except Exception as e:
         print(f"\nERREUR: Une erreur est survenue pendant l'OCR: {e}")
         return None